@@ -1,45 +1,317 @@
-import CloudFlare
-import requests
+# requests is imported where first used, so argument errors and --help return without loading it
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from collections import defaultdict
+from itertools import chain
+from types import MappingProxyType
+import argparse
+import threading
+import hashlib
+import json
+import re
 import sys
 import os
+import io
 
-# Define your Cloudflare email and API key here
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+# Define your Cloudflare API token, or email and API key, here (or pass them on the command line)
+CLOUDFLARE_API_TOKEN = ''
 CLOUDFLARE_EMAIL = ''
 CLOUDFLARE_API_KEY = ''
 
+CLOUDFLARE_API_URL = 'https://api.cloudflare.com/client/v4'
+
+# Zone IDs never change for the lifetime of a zone, so name lookups are cached across runs
+ZONE_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'cfso', 'zones.json')
+
+# Cloudflare error codes returned when a zone ID no longer refers to an existing zone
+STALE_ZONE_ERROR_CODES = {1001, 7003}
+
+# Matches an SPF policy at the start of a TXT value, allowing for the surrounding quotes Cloudflare may return
+SPF_RE = re.compile(rb'(?m)(?:^|[\s"])v=spf1\b')
+
+# Record types at the zone apex that prevent creating the placeholder AAAA record, in the order they are checked
+ROOT_RECORD_TYPES = ('AAAA', 'A', 'CNAME')
+
+# Status codes worth retrying: rate limiting and transient gateway errors
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+# Number of zones hardened at the same time when several are given on the command line
+MAX_CONCURRENT_ZONES = 4
+
+# Number of Cloudflare calls made at the same time for one zone
+MAX_CONCURRENT_REQUESTS_PER_ZONE = 8
+
+# Zone settings applied to every zone. Only read at import to build ZONE_SETTINGS_ENCODED below,
+# which is what the requests send; the proxy guards the top level only, not the nested values
+ZONE_SETTINGS = MappingProxyType({
+    'ssl': {'value': 'strict'},
+    'min_tls_version': {'value': '1.2'},
+    'tls_1_3': {'value': 'on'},
+    'always_use_https': {'value': 'on'},
+    'automatic_https_rewrites': {'value': 'on'},
+    'security_header': {
+        'value': {
+            'strict_transport_security': {
+                'enabled': True,
+                'max_age': 31536000,  # 12 months in seconds
+                'include_subdomains': True,
+                'preload': True,
+                'nosniff': True
+            }
+        }
+    }
+})
+
+# Setting bodies encoded once at import instead of on every request
+ZONE_SETTINGS_ENCODED = tuple((setting, json_dumps(data)) for setting, data in ZONE_SETTINGS.items())
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Return the shared session, so the HSTS submission and direct Cloudflare REST calls reuse pooled keep-alive connections."""
+    global _session
+    # Zone worker threads ask for the session at the same moment, so it is built under a lock to create only one pool
+    with _session_lock:
+        if _session is None:
+            _session = _build_session()
+        return _session
+
+def _build_session():
+    """Build a session whose adapter pools connections and retries rate-limited and transient failures."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=8,
+        # Enough connections for every request in flight across all zones, so none are discarded and re-handshaken
+        pool_maxsize=MAX_CONCURRENT_ZONES * MAX_CONCURRENT_REQUESTS_PER_ZONE,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=RETRY_STATUS_CODES,
+            respect_retry_after_header=True,
+            allowed_methods=frozenset({'GET', 'POST', 'PATCH', 'PUT', 'DELETE'}),
+            raise_on_status=False
+        )
+    ))
+    return session
+
+# Per-thread output stream, so zones hardened concurrently do not interleave their reports
+_output = threading.local()
+
+# Status prefixes encoded once, as every status line is written as bytes
+_OK = "[✓] ".encode('utf-8')
+_FAIL = "[✗] ".encode('utf-8')
+
+def output():
+    """Return the binary output stream of the zone being processed, or stdout outside of a zone."""
+    return getattr(_output, 'stream', sys.stdout.buffer)
+
+def write(text):
+    """Write text to the current output stream."""
+    output().write(text.encode('utf-8'))
+
 def print_status(success, message):
     """Prints the status of an operation with a check mark or cross mark."""
-    status_symbol = "[✓]" if success else "[✗]"
-    print(f"{status_symbol} {message}\n")
-
-def initialize_cloudflare(email, api_key):
-    """Initialize the CloudFlare client using only email and API key."""
-    print("[i] Initializing with API Key and Email")
-    return CloudFlare.CloudFlare(email=email, key=api_key)
-
-def get_zone_name():
-    """Get the zone name from the command line argument."""
-    if len(sys.argv) != 2:
-        print("[✗] Incorrect usage. Please provide just the zone name.")
-        sys.exit(1)
-    return sys.argv[1]
-
-def check_dns_record_exists(cf, zone_id, record_types, name):
-    """Check if a DNS record of the specified types and name already exists."""
-    for record_type in record_types:
-        dns_records = cf.zones.dns_records.get(zone_id, params={'type': record_type, 'name': name})
-        if dns_records:
-            print_status(False, f"An existing {record_type} record found for {name}.")
-            return True, record_type  # Record found, return True and the record type
-    return False, None  # No record found, return False and None
+    output().write((_OK if success else _FAIL) + message.encode('utf-8') + b"\n\n")
+
+class CloudflareAPIError(Exception):
+    """Raised when a Cloudflare API call fails, carrying Cloudflare's error code."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+def auth_headers(*, token=None, email=None, key=None):
+    """Build the authentication headers for Cloudflare API calls using either an API token or email and API key."""
+    if token:
+        return {'Authorization': f"Bearer {token}"}
+    return {'X-Auth-Email': email, 'X-Auth-Key': key}
+
+def parse_arguments():
+    """Parse the zone names and credentials from the command line, falling back to the values defined above."""
+    parser = argparse.ArgumentParser(description="Apply security hardening to Cloudflare zones.")
+    parser.add_argument('zones', nargs='+', metavar='zone', help="zone name to harden, e.g. example.com")
+    parser.add_argument('--token', help="Cloudflare API token")
+    parser.add_argument('--email', help="Cloudflare account email, used together with --key")
+    parser.add_argument('--key', help="Cloudflare global API key, used together with --email")
+    args = parser.parse_args()
+    if args.token and (args.email or args.key):
+        parser.error("use either --token or --email and --key, not both")
+    if bool(args.email) != bool(args.key):
+        parser.error("--email and --key must be given together")
+
+    if args.token or args.email:
+        credentials = {'token': args.token, 'email': args.email, 'key': args.key}
+    elif CLOUDFLARE_API_TOKEN:
+        credentials = {'token': CLOUDFLARE_API_TOKEN}
+    else:
+        credentials = {'email': CLOUDFLARE_EMAIL, 'key': CLOUDFLARE_API_KEY}
+    return args.zones, credentials
+
+_zone_cache_lock = threading.Lock()
+
+def credential_fingerprint(*, token=None, email=None, key=None):
+    """Hash the credentials, so cached zone IDs are keyed per account without storing secrets."""
+    secret = token if token else f"{email}:{key}"
+    return hashlib.sha256(secret.encode('utf-8')).hexdigest()
+
+_zone_cache = None
+
+def load_zone_cache():
+    """Load the persisted zone ID cache once per run, so concurrent zones share a single dict."""
+    global _zone_cache
+    with _zone_cache_lock:
+        if _zone_cache is None:
+            try:
+                with open(ZONE_CACHE_PATH) as f:
+                    _zone_cache = json.load(f)
+            except (OSError, ValueError):
+                _zone_cache = {}
+        return _zone_cache
+
+def save_zone_cache(cache):
+    """Persist the zone ID cache, ignoring failures as it is only an optimization."""
+    try:
+        os.makedirs(os.path.dirname(ZONE_CACHE_PATH), exist_ok=True)
+        with open(ZONE_CACHE_PATH, 'w') as f:
+            json.dump(cache, f)
+    except OSError:
+        pass
+
+def normalize_zone_name(zone_name):
+    """Convert a zone name to the lowercase punycode form Cloudflare uses for zone and record names."""
+    zone_name = zone_name.strip().rstrip('.')
+    try:
+        zone_name = zone_name.encode('idna').decode('ascii')
+    except UnicodeError:
+        pass
+    return zone_name.lower()
+
+def resolve_zone_id(fingerprint, zone_name, headers):
+    """Return the zone ID and Cloudflare's canonical zone name, only querying Cloudflare on a cache miss."""
+    cache = load_zone_cache()
+    key = f"{fingerprint}:{zone_name}"
+    with _zone_cache_lock:
+        entry = cache.get(key)
+        # Entries written before the canonical name was cached are plain IDs, and are looked up again
+        if isinstance(entry, dict):
+            return entry['id'], entry['name']
+    zones = api_request('GET', '/zones', headers, params={'name': zone_name})
+    if not zones:
+        return None, None
+    with _zone_cache_lock:
+        cache[key] = {'id': zones[0]['id'], 'name': zones[0]['name']}
+        save_zone_cache(cache)
+        return zones[0]['id'], zones[0]['name']
+
+def invalidate_zone_id(fingerprint, zone_name):
+    """Drop a zone ID from the cache, so the next lookup queries Cloudflare again."""
+    cache = load_zone_cache()
+    with _zone_cache_lock:
+        if cache.pop(f"{fingerprint}:{zone_name}", None) is not None:
+            save_zone_cache(cache)
+
+def fetch_all_records(zone_id, headers, per_page=5000):
+    """Fetch every DNS record in the zone, following result_info.total_pages as the API may cap per_page."""
+    records = []
+    page = 1
+    while True:
+        response_json = api_response('GET', f"/zones/{zone_id}/dns_records", headers,
+                                     params={'per_page': per_page, 'page': page})
+        records.extend(response_json['result'])
+        total_pages = (response_json.get('result_info') or {}).get('total_pages') or 1
+        if page >= total_pages:
+            return records
+        page += 1
 
+def partition_records(records):
+    """Group the zone's records by type in a single pass, so every check reads from the same fetch."""
+    records_by_type = defaultdict(list)
+    for record in records:
+        records_by_type[record['type']].append(record)
+    return records_by_type
+
+def _first_match(records, name):
+    """Return the type of the first record with the given name, or None, stopping at the first match."""
+    return next((record['type'] for record in records if record['name'] == name), None)
+
+def check_dns_record_exists(records_by_type, record_types, name):
+    """Check if a DNS record of the specified types and name exists in the fetched records."""
+    # Records are already grouped by type, so only the wanted groups are scanned, in the order given
+    candidates = chain.from_iterable(records_by_type[record_type] for record_type in record_types)
+    record_type = _first_match(candidates, name)
+    if record_type is None:
+        return False, None  # No record found, return False and None
+    print_status(False, f"An existing {record_type} record found for {name}.")
+    return True, record_type  # Record found, return True and the record type
+
+def spf_record_exists(txt_records):
+    """Check for an SPF policy with one regex scan over the joined TXT record contents."""
+    buffer = b"\n".join(record['content'].encode('utf-8', 'replace') for record in txt_records)
+    return SPF_RE.search(buffer) is not None
+
+def api_response(method, path, headers, **kwargs):
+    """Send a request to the Cloudflare REST API over the shared session and return the whole response body."""
+    import requests
+
+    try:
+        response = get_session().request(method, f"{CLOUDFLARE_API_URL}{path}", headers=headers, **kwargs)
+    except requests.exceptions.RequestException as e:
+        raise CloudflareAPIError(0, str(e)) from e
+    try:
+        response_json = json_loads(response.content)
+    except ValueError:
+        raise CloudflareAPIError(response.status_code, response.text)
+    if not response_json.get('success'):
+        errors = response_json.get('errors') or [{'code': response.status_code, 'message': response.text}]
+        raise CloudflareAPIError(errors[0]['code'], errors[0]['message'])
+    return response_json
+
+def api_request(method, path, headers, **kwargs):
+    """Send a request to the Cloudflare REST API over the shared session and return its result."""
+    return api_response(method, path, headers, **kwargs)['result']
+
+def enable_dnssec(zone_id, headers):
+    """Enable DNSSEC for the zone."""
+    return api_request('PATCH', f"/zones/{zone_id}/dnssec", headers, json={'status': 'active'})
+
+def create_dns_records(zone_id, records, headers):
+    """Create several DNS records in one request using the batch endpoint."""
+    return api_request('POST', f"/zones/{zone_id}/dns_records/batch", headers, json={'posts': records}).get('posts', [])
+
+def update_zone_setting(zone_id, setting, body, headers):
+    """Update one zone setting with an already JSON-encoded request body."""
+    return api_request('PATCH', f"/zones/{zone_id}/settings/{setting}",
+                       {**headers, 'Content-Type': 'application/json'}, data=body)
 
 def submit_domain_to_hsts_preload(domain_name):
     """Submit the domain to the HSTS preload list using a POST request."""
+    import requests
+
     url = f"https://hstspreload.org/api/v2/submit?domain={domain_name}"
-    response = requests.post(url)
+    try:
+        response = get_session().post(url)
+    except requests.exceptions.RequestException as e:
+        print_status(False, f"Failed to submit domain {domain_name} to HSTS preload list: {e}")
+        return
     if response.status_code == 200:
-        response_json = response.json()
+        try:
+            response_json = json_loads(response.content)
+        except ValueError as e:
+            print_status(False, f"Failed to read the HSTS preload response for {domain_name}: {e}")
+            return
         if "errors" in response_json:
             for error in response_json["errors"]:
                 print_status(False, f"Error: {error['summary']} - {error['message']}")
@@ -47,98 +319,144 @@ def submit_domain_to_hsts_preload(domain_name):
                 print_status(True, f"Domain {domain_name} submitted to HSTS preload list successfully.")
         if "warnings" in response_json:
             for warning in response_json["warnings"]:
-                print(f"Warning: {warning['summary']} - {warning['message']}")
+                write(f"Warning: {warning['summary']} - {warning['message']}\n")
     else:
         print_status(False, f"Failed to submit domain {domain_name} to HSTS preload list. Status code: {response.status_code}")
-        print("Response text:", response.text)
+        write(f"Response text: {response.text}\n")
 
-def main():
-    os.environ.pop('CF_API_KEY', None)
-    os.environ.pop('CF_API_EMAIL', None)
-    os.environ.pop('CF_API_TOKEN', None)
-    
-    zone_name = get_zone_name()
-    cf = initialize_cloudflare(email=CLOUDFLARE_EMAIL, api_key=CLOUDFLARE_API_KEY)
-
-    print(f"\n------[ Domain level checks for ]-----\nName:    {zone_name}\n")
+def report_zone(credentials, zone_name):
+    """Harden one zone, returning its report instead of printing it directly."""
+    _output.stream = io.BytesIO()
+    try:
+        harden_zone(credentials, zone_name)
+    except Exception as e:
+        # Keep the partial report, as earlier steps may already have changed the zone
+        print_status(False, f"Unexpected error while hardening {zone_name}: {e!r}")
+    try:
+        return _output.stream.getvalue()
+    finally:
+        del _output.stream
 
+def lookup_zone_id(fingerprint, zone_name, headers):
+    """Resolve and report the zone ID and canonical zone name, returning None for both when the zone cannot be found."""
     try:
-        zones = cf.zones.get(params={'name': zone_name})
-        if not zones:
+        zone_id, canonical_name = resolve_zone_id(fingerprint, zone_name, headers)
+        if not zone_id:
             print_status(False, 'No zones found for the specified name.')
-            return
-        zone_id = zones[0]['id']
+            return None, None
         print_status(True, f"Zone ID: {zone_id}")
-    except CloudFlare.exceptions.CloudFlareAPIError as e:
+        return zone_id, canonical_name
+    except CloudflareAPIError as e:
         print_status(False, f'Error fetching zone information: {e}')
+        return None, None
+
+def configure_zone(zone_id, headers):
+    """Apply DNSSEC and zone settings, returning the DNS record listing future, the status lines and whether the zone ID was stale."""
+    # Enable DNSSEC, update zone settings and list DNS records concurrently, as none depend on each other
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS_PER_ZONE) as executor:
+        records_future = executor.submit(fetch_all_records, zone_id, headers)
+        tasks = [("DNSSEC enabled successfully.", "Failed to enable DNSSEC",
+                  partial(enable_dnssec, zone_id, headers))]
+        for setting, body in ZONE_SETTINGS_ENCODED:
+            tasks.append((f"{setting} updated successfully.", f"Failed to update {setting}",
+                          partial(update_zone_setting, zone_id, setting, body, headers)))
+        futures = {executor.submit(call): (success_message, failure_message)
+                   for success_message, failure_message, call in tasks}
+        # Status lines are returned rather than printed, as a stale zone ID makes every call fail and is retried
+        statuses = []
+        stale_zone_id = False
+        for future in as_completed(futures):
+            success_message, failure_message = futures[future]
+            try:
+                future.result()
+                statuses.append((True, success_message))
+            except CloudflareAPIError as e:
+                stale_zone_id = stale_zone_id or e.code in STALE_ZONE_ERROR_CODES
+                statuses.append((False, f"{failure_message}: {e}"))
+    return records_future, statuses, stale_zone_id
+
+def harden_zone(credentials, zone_name):
+    """Apply DNSSEC, DNS record, zone setting and HSTS preload hardening to one zone."""
+    write(f"\n------[ Domain level checks for ]-----\nName:    {zone_name}\n\n")
+
+    zone_name = normalize_zone_name(zone_name)
+    fingerprint = credential_fingerprint(**credentials)
+    headers = auth_headers(**credentials)
+    zone_id, canonical_name = lookup_zone_id(fingerprint, zone_name, headers)
+    if not zone_id:
         return
 
-    # Enable DNSSEC
-    try:
-        cf.zones.dnssec.patch(zone_id, data={'status': 'active'})
-        print_status(True, "DNSSEC enabled successfully.")
-    except CloudFlare.exceptions.CloudFlareAPIError as e:
-        print_status(False, f"Failed to enable DNSSEC: {e}")
+    records_future, statuses, stale_zone_id = configure_zone(zone_id, headers)
+    if stale_zone_id:
+        # The cached ID may belong to a deleted and re-added zone, so look it up again once before giving up
+        invalidate_zone_id(fingerprint, zone_name)
+        print_status(False, f"Zone ID {zone_id} is no longer valid, looking up {zone_name} again.")
+        zone_id, canonical_name = lookup_zone_id(fingerprint, zone_name, headers)
+        if not zone_id:
+            return
+        records_future, statuses, stale_zone_id = configure_zone(zone_id, headers)
 
-    # DNS Records Check and Management
+    for success, message in statuses:
+        print_status(success, message)
+    if stale_zone_id:
+        invalidate_zone_id(fingerprint, zone_name)
+        print_status(False, f"Zone ID {zone_id} is not valid for {zone_name}.")
+        return
+
+    # DNS Records Check, collecting missing records for a single batch request
+    to_create = []
     try:
-        record_exists, record_type = check_dns_record_exists(cf, zone_id, ['AAAA', 'A', 'CNAME'], '@')
+        # Record names are matched against the zone name Cloudflare returned, not the one typed on the command line
+        records_by_type = partition_records(records_future.result())
+        record_exists, record_type = check_dns_record_exists(records_by_type, ROOT_RECORD_TYPES, canonical_name)
         if not record_exists:
-            cf.zones.dns_records.post(zone_id, data={
+            to_create.append({
                 'name': '@',
                 'type': 'AAAA',
                 'content': '100::',
                 'ttl': 120,
                 'proxied': True
             })
-            print_status(True, "AAAA record for @ with value 100:: created successfully.")
         else:
             print_status(False, f"An existing {record_type} record prevents AAAA record creation for '@'.")
-    except CloudFlare.exceptions.CloudFlareAPIError as e:
-        print_status(False, f"Failed to manage DNS records: {e}")
 
-    # Zone Settings Updates
-    try:
-        settings = {
-            'ssl': {'value': 'strict'},
-            'min_tls_version': {'value': '1.2'},
-            'tls_1_3': {'value': 'on'},
-            'always_use_https': {'value': 'on'},
-            'automatic_https_rewrites': {'value': 'on'},
-            'security_header': {
-                'value': {
-                    'strict_transport_security': {
-                        'enabled': True,
-                        'max_age': 31536000,  # 12 months in seconds
-                        'include_subdomains': True,
-                        'preload': True,
-                        'nosniff': True
-                    }
-                }
-            }
-        }
-        for setting, data in settings.items():
-            cf.zones.settings.patch(zone_id, setting, data=data)
-            print_status(True, f"{setting} updated successfully.")
-    except CloudFlare.exceptions.CloudFlareAPIError as e:
-        print_status(False, f"Failed to update zone settings: {e}")
-
-    # SPF Record Handling
-    try:
-        dns_records = cf.zones.dns_records.get(zone_id, params={'type': 'TXT'})
-        spf_exists = any('v=spf1' in record['content'] for record in dns_records)
-        if not spf_exists:
-            cf.zones.dns_records.post(zone_id, data={'name': '@', 'type': 'TXT', 'content': 'v=spf1 -all', 'ttl': 120})
-            print_status(True, "SPF record for no email added successfully.")
+        # SPF Record Check
+        if not spf_record_exists(records_by_type['TXT']):
+            to_create.append({'name': '@', 'type': 'TXT', 'content': 'v=spf1 -all', 'ttl': 120})
         else:
             print_status(False, "Existing SPF record found. No new SPF record added.")
-    except CloudFlare.exceptions.CloudFlareAPIError as e:
-        print_status(False, f"Failed to manage SPF records: {e}")
+    except CloudflareAPIError as e:
+        print_status(False, f"Failed to manage DNS records: {e}")
+
+    # DNS Record Creation
+    if to_create:
+        try:
+            create_dns_records(zone_id, to_create, headers)
+            for record in to_create:
+                if record['type'] == 'TXT':
+                    print_status(True, "SPF record for no email added successfully.")
+                else:
+                    print_status(True, f"{record['type']} record for @ with value {record['content']} created successfully.")
+        except CloudflareAPIError as e:
+            print_status(False, f"Failed to create DNS records: {e}")
 
     # HSTS Preload List Submission
-    submit_domain_to_hsts_preload(zone_name)
+    submit_domain_to_hsts_preload(canonical_name)
+
+    write("Configuration complete.\n\n")
+
+def main():
+    zone_names, credentials = parse_arguments()
+    if credentials.get('token'):
+        write("[i] Initializing with API Token\n")
+    else:
+        write("[i] Initializing with API Key and Email\n")
 
-    print("Configuration complete.\n")
+    # Zones are independent, so several are hardened concurrently over the shared session
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_ZONES) as executor:
+        for report in executor.map(partial(report_zone, credentials), zone_names):
+            sys.stdout.buffer.write(report)
+            sys.stdout.buffer.flush()
 
 if __name__ == '__main__':
     main()